@@ -10,11 +10,84 @@ IRC double-puppeting bridge.
 """
 
 import asyncio
-import re
+import collections
+import logging
 import sys
 
 from galene_bot import ArgumentParser, GaleneBot
 
+log = logging.getLogger(__name__)
+
+
+def _parse_irc(cmd: bytes):
+    """Split IRC command into tags, prefix, command and parameters.
+
+    IRC grammar is "[@tags] [:prefix] COMMAND [params]", so a single left to
+    right pass is enough to tokenize it. Delimiters are ASCII, so this works
+    on raw bytes.
+
+    :param cmd: received command
+    :type cmd: bytes
+    :return: tuple (tags, prefix, command, params), tags and prefix are None
+        if absent
+    """
+    tags, prefix = None, None
+    if cmd.startswith(b"@"):
+        tags, _, cmd = cmd[1:].partition(b" ")
+        cmd = cmd.lstrip(b" ")
+    if cmd.startswith(b":"):
+        prefix, _, cmd = cmd[1:].partition(b" ")
+        cmd = cmd.lstrip(b" ")
+    command, _, params = cmd.partition(b" ")
+    return tags, prefix, command, params.lstrip(b" ")
+
+
+def _decode(data: bytes) -> str:
+    """Decode bytes received from IRC, ignoring invalid UTF-8.
+
+    :param data: received bytes
+    :type data: bytes
+    :return: decoded text
+    """
+    return data.decode("utf-8", "ignore")
+
+
+def _encode_line(line: str) -> bytes:
+    """Encode one IRC line, with its CRLF terminator.
+
+    :param line: line to send, without terminator
+    :type line: str
+    :return: encoded line
+    """
+    return f"{line}\r\n".encode()
+
+
+class SPSCQueue:
+    """Lightweight single-producer single-consumer queue for coroutines."""
+
+    def __init__(self):
+        """Create empty queue."""
+        self._items = collections.deque()
+        self._event = asyncio.Event()
+
+    def put(self, item):
+        """Put item in queue and wake up consumer.
+
+        :param item: item to enqueue
+        """
+        self._items.append(item)
+        self._event.set()
+
+    async def get(self):
+        """Remove and return an item, wait if queue is empty.
+
+        :return: first item of the queue
+        """
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popleft()
+
 
 class IRCClient:
     """Simple IRC client writting to a channel."""
@@ -32,9 +105,9 @@ class IRCClient:
         """Init IRC client.
 
         :param rx_queue: receive queue
-        :type rx_queue: async.Queue
+        :type rx_queue: SPSCQueue
         :param tx_queue: transmit queue
-        :type tx_queue: async.Queue
+        :type tx_queue: SPSCQueue
         :param server: server hostname to connect to
         :type server: str
         :param port: port to contact, defaults to 6697 for TLS, or 6667
@@ -71,7 +144,7 @@ class IRCClient:
         :param message: message to send
         :type message: str
         """
-        self.writer.write(f"{message}\r\n".encode())
+        self.writer.write(_encode_line(message))
         await self.writer.drain()
 
     async def _connect(self):
@@ -89,12 +162,27 @@ class IRCClient:
         """Receive from IRC loop."""
         await self._connect()
 
+        # Keep incomplete trailing line between reads
+        buf = bytearray()
         while True:
-            data = await self.reader.read(4096)
-            data = data.decode("utf-8", "ignore").split("\r\n")
-            for command in data:
+            data = await self.reader.read(65536)
+            if not data:
+                break  # connection closed
+            buf.extend(data)
+
+            # Answer all commands of this read with a single write
+            replies = bytearray()
+            while True:
+                idx = buf.find(b"\r\n")
+                if idx < 0:
+                    break
+                command = bytes(buf[:idx])
+                del buf[: idx + 2]
                 if command:
-                    await self.process_command(command)
+                    replies += self.process_command(command)
+            if replies:
+                self.writer.write(replies)
+                await self.writer.drain()
 
     async def loop_transmit(self):
         """Transmit to IRC loop."""
@@ -102,58 +190,56 @@ class IRCClient:
         while not self.joined:
             await asyncio.sleep(1)
 
-        # For each incoming message, send
+        # For each incoming message, send all lines at once
         while True:
             message = await self.rx_queue.get()
-            for m in message.split("\n"):
-                await self._send(f"PRIVMSG {self.channel} :{m}")
-            self.rx_queue.task_done()
+            payload = b"".join(
+                _encode_line(f"PRIVMSG {self.channel} :{m}")
+                for m in message.split("\n")
+            )
+            self.writer.write(payload)
+            await self.writer.drain()
 
-    async def process_command(self, cmd: str):
+    def process_command(self, cmd: bytes) -> bytes:
         """Process IRC command.
 
         :param cmd: received command
-        :type cmd: str
+        :type cmd: bytes
+        :return: commands to send back to the server, may be empty
         """
         # Parse IRC command
-        match = re.match(
-            r"^(?P<tags>@(?:(?:\+?(?:[0-9A-Za-z.-]+/)?[0-9A-Za-z-]+)(?:=[^\x00\r\n; ]+)?)?(?:;(?:\+?(?:[0-9A-Za-z.-]+/)?[0-9A-Za-z-]+)(?:=[^\x00\r\n; ]+)?)*)? *(?::(?P<target>[^ ]*))? *(?P<command>[a-zA-Z]+|[0-9]{3}) *(?:(?P<params>.*?))?$",
-            cmd,
-        )
-        if match is None:
-            print("Unknown command:", cmd)
-            return
-        command = match.group("command")
+        _, target, command, params = _parse_irc(cmd)
+        if not command:
+            log.warning(f"Unknown command: {_decode(cmd)}")
+            return b""
+        nickname = (target or b"").partition(b"!")[0]
 
         # Implement actions
-        if command == "PING":
-            data = match.group("params")[1:]
-            await self._send(f"PONG :{data}")
-        elif command == "PRIVMSG":
-            nickname = match.group("target").split("!")[0]
-            message = match.group("params").split(":", 1)[-1]
-            await self.tx_queue.put(f"<{nickname}> {message}")
-        elif command == "JOIN":
+        if command == b"PING":
+            return _encode_line(f"PONG :{_decode(params[1:])}")
+        elif command == b"PRIVMSG":
+            message = params.split(b":", 1)[-1]
+            self.tx_queue.put(f"<{_decode(nickname)}> {_decode(message)}")
+        elif command == b"JOIN":
             # User joined
-            nickname = match.group("target").split("!")[0]
-            await self.tx_queue.put(f"{nickname} joined")
-        elif command == "QUIT":
+            self.tx_queue.put(f"{_decode(nickname)} joined")
+        elif command == b"QUIT":
             # User left
-            nickname = match.group("target").split("!")[0]
-            await self.tx_queue.put(f"{nickname} left")
-        elif command == "001":
+            self.tx_queue.put(f"{_decode(nickname)} left")
+        elif command == b"001":
             # On welcome, join channel
-            await self._send(f"JOIN {self.channel}")
             self.joined = True
-        elif command == "433":
+            return _encode_line(f"JOIN {self.channel}")
+        elif command == b"433":
             # Nickname is already in use
             self.nickname = self.nickname + "_"
-            await self._send(f"NICK {self.nickname}")
-        elif command == "353":
+            return _encode_line(f"NICK {self.nickname}")
+        elif command == b"353":
             # List of users
-            users = match.group("params").split(":", 1)[-1].split(" ")
+            users = _decode(params.split(b":", 1)[-1]).split(" ")
             for user in users:
-                await self.tx_queue.put(f"{user} joined")
+                self.tx_queue.put(f"{user} joined")
+        return b""
 
 
 class GaleneMainClient(GaleneBot):
@@ -163,9 +249,9 @@ class GaleneMainClient(GaleneBot):
         """Override init to get receive and transmit event queues.
 
         :param rx_queue: receive queue
-        :type rx_queue: async.Queue
+        :type rx_queue: SPSCQueue
         :param tx_queue: transmit queue
-        :type tx_queue: async.Queue
+        :type tx_queue: SPSCQueue
         """
         super().__init__(*args, **kwargs)
         self.rx_queue = rx_queue
@@ -181,7 +267,6 @@ class GaleneMainClient(GaleneBot):
         while True:
             m = await self.rx_queue.get()
             await self.send_chat(m)
-            self.rx_queue.task_done()
 
     async def on_chat(self, kind, _, username: str, value: str, time: int):
         """On new chat event.
@@ -194,7 +279,7 @@ class GaleneMainClient(GaleneBot):
         :type username: str
         :param value: text message
         :type value: str
-        :param time: time of the message
+        :param time: time of the message, in milliseconds since epoch
         :type time: int
         """
         # Get only new messages
@@ -203,10 +288,10 @@ class GaleneMainClient(GaleneBot):
 
         if kind == "me":
             # Action message
-            await self.tx_queue.put(f"{username} {value}")
+            self.tx_queue.put(f"{username} {value}")
         else:
             # Standard message
-            await self.tx_queue.put(f"<{username}> {value}")
+            self.tx_queue.put(f"<{username}> {value}")
 
     async def on_user_add(self, _, username: str):
         """User joined group event.
@@ -214,7 +299,7 @@ class GaleneMainClient(GaleneBot):
         :param username: username of the new user
         :type username: str
         """
-        await self.tx_queue.put(f"{username} joined")
+        self.tx_queue.put(f"{username} joined")
 
     async def on_user_delete(self, _, username: str):
         """User left group event.
@@ -222,7 +307,7 @@ class GaleneMainClient(GaleneBot):
         :param username: username of the leaving user
         :type username: str
         """
-        await self.tx_queue.put(f"{username} left")
+        self.tx_queue.put(f"{username} left")
 
 
 def main():
@@ -259,8 +344,8 @@ def main():
     opt = parser.parse_args()
 
     # Message queues for corroutine communication
-    queue_galene_to_irc = asyncio.Queue()
-    queue_irc_to_galene = asyncio.Queue()
+    queue_galene_to_irc = SPSCQueue()
+    queue_irc_to_galene = SPSCQueue()
 
     # Main client read messages and list users
     # Puppets only write messages
@@ -6,6 +6,8 @@
 Smile bot.
 """
 
+import re
+
 from galene_bot import ArgumentParser, GaleneBot
 
 
@@ -19,26 +21,42 @@ class SmileBot(GaleneBot):
         "🙁": "🙂",
     }
 
+    # Map sad smile to precomputed (padded sad smile, happy smile)
+    _smiles = {sad: (f" {sad} ", happy) for sad, happy in smiles.items()}
+
+    # Find all sad smiles in one pass over the message, longest first so a
+    # smile is not shadowed by one of its prefixes
+    _sad_re = re.compile(
+        "|".join(map(re.escape, sorted(smiles, key=len, reverse=True)))
+    )
+
     async def on_chat(self, _, __, ___, value: str, time: int):
         """On new chat event.
 
         :param value: text message
         :type value: str
-        :param time: time of the message
+        :param time: time of the message, in milliseconds since epoch
         :type time: int
         """
         # Get only new messages
         if self.is_history(time):
             return
 
+        # Most messages are not sad, stop early
+        first_match = self._sad_re.search(value)
+        if first_match is None:
+            return
+
         # Make user happy
-        for sad_smile, happy_smile in self.smiles.items():
-            if sad_smile in value:
-                if f" {sad_smile} " not in f" {value} ":
-                    continue  # This is not really a sad message
+        padded_value = f" {value} "
+        for match in self._sad_re.finditer(value, first_match.start()):
+            sad_smile = match.group()
+            padded_sad_smile, happy_smile = self._smiles[sad_smile]
+            if len(value) != len(sad_smile) and padded_sad_smile not in padded_value:
+                continue  # This is not really a sad message
 
-                await self.send_chat(happy_smile)
-                return
+            await self.send_chat(happy_smile)
+            return
 
 
 def main():
@@ -6,11 +6,15 @@
 Welcome new users.
 """
 
+import asyncio
+import logging
 import random
-from datetime import datetime
+import time
 
 from galene_bot import ArgumentParser, GaleneBot
 
+log = logging.getLogger(__name__)
+
 
 class WelcomeBot(GaleneBot):
     """A bot that welcomes new users."""
@@ -45,10 +49,26 @@ class WelcomeBot(GaleneBot):
         "???",
     ]
 
+    # Users joining within this delay (in seconds) are welcomed together
+    welcome_delay = 0.2
+
     def __init__(self, *args, **kwargs):
         """Override init to get time."""
         super().__init__(*args, **kwargs)
-        self.init_time = datetime.now()
+        self.init_time_ms = int(time.time() * 1000)
+        self._pending_joins = []  # usernames waiting to be welcomed
+        self._welcome_task = None
+
+    async def loop(self):
+        """Override client loop to stop pending welcome on exit."""
+        try:
+            await super().loop()
+        finally:
+            # Connection is gone, drop pending welcome
+            self._pending_joins = []
+            if self._welcome_task is not None:
+                self._welcome_task.cancel()
+                await asyncio.wait({self._welcome_task})
 
     async def on_user_add(self, user_id: str, username: str):
         """User joined group event.
@@ -59,16 +79,45 @@ class WelcomeBot(GaleneBot):
         :type username: str
         """
         # Skip first 5s events to ignore old users
-        if not self.is_history(self.init_time):
+        if not self.is_history(self.init_time_ms):
             return
 
         # Invent a name for anonymous users
         if username == "(anon)":
             username = random.choice(self.anonymous_usernames)
 
+        # Group burst of joins in one message
+        self._pending_joins.append(username)
+        if len(self._pending_joins) == 1:
+            self._welcome_task = asyncio.ensure_future(self._welcome_pending())
+            self._welcome_task.add_done_callback(self._on_welcome_done)
+
+    async def _welcome_pending(self):
+        """Welcome all users that joined during the welcome delay."""
+        await asyncio.sleep(self.welcome_delay)
+        await self._welcome_now()
+
+    async def _welcome_now(self):
+        """Send one welcome message for all pending joins."""
+        usernames, self._pending_joins = self._pending_joins, []
+        if not usernames:
+            return
+        username = usernames[-1]
+        if len(usernames) > 1:
+            username = ", ".join(usernames[:-1]) + " and " + username
+
         msg = random.choice(self.welcome_msg).format(username=username)
         await self.send_chat(msg)
 
+    def _on_welcome_done(self, task):
+        """Log welcome failure instead of losing it.
+
+        :param task: welcome task
+        :type task: asyncio.Task
+        """
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Failed to welcome users: {task.exception()!r}")
+
     async def on_user_delete(self, user_id: str, username: str):
         """User left group event.
 
@@ -78,13 +127,19 @@ class WelcomeBot(GaleneBot):
         :type username: str
         """
         # Skip first 5s events to ignore old users
-        if not self.is_history(self.init_time):
+        if not self.is_history(self.init_time_ms):
             return
 
         # Invent a name for anonymous users
         if username == "(anon)":
             username = random.choice(self.anonymous_usernames)
 
+        # Welcome pending users first, so nobody is greeted after leaving.
+        # Joins are pending only while the welcome task sleeps.
+        if self._pending_joins:
+            self._welcome_task.cancel()
+            await self._welcome_now()
+
         msg = random.choice(self.leave_msg).format(username=username)
         await self.send_chat(msg)
 
@@ -10,6 +10,11 @@ import asyncio
 import logging
 import sys
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 class ArgumentParser(argparse.ArgumentParser):
     """Argument parser for a bot that also configures logging."""
@@ -50,7 +55,7 @@ class ArgumentParser(argparse.ArgumentParser):
         )
 
     def parse_args(self, *args, **kwargs):
-        """Override argparse parse_args to configure logging."""
+        """Override argparse parse_args to configure logging and event loop."""
         options = super().parse_args(*args, **kwargs)
 
         # Configure logging
@@ -63,6 +68,10 @@ class ArgumentParser(argparse.ArgumentParser):
             level=level,
             format="\033[90m%(asctime)s\033[1;0m [%(name)s] %(levelname)s %(message)s\033[1;0m",
         )
+
+        # Use faster event loop if available, before any loop is created
+        if uvloop is not None:
+            uvloop.install()
         return options
 
     def run(self, BotClass, *args, **kwargs):
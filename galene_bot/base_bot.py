@@ -5,20 +5,58 @@
 Base class to implement a bot for Galène.
 """
 
+import asyncio
 import json
 import logging
 import secrets
 import ssl
-from datetime import datetime, timedelta
+import sys
+import time
 
 import websockets
 
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        """Serialize object to JSON string using orjson."""
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
 log = logging.getLogger(__name__)
 
+_ssl_ctx = None  # shared SSL context, see _get_ssl_context
+
+
+def _get_ssl_context():
+    """Return SSL context, created on first call.
+
+    Loading CA certificates is expensive, so the context is reused across
+    connections.
+
+    :return: SSL context
+    """
+    global _ssl_ctx
+    if _ssl_ctx is None:
+        _ssl_ctx = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
+    return _ssl_ctx
+
 
 class GaleneBot:
     """Galène protocol implementation for bot."""
 
+    # Websocket compression, disabled as chat messages are too small to
+    # benefit from it. Set to "deflate" for bots exchanging large payloads.
+    ws_compression = None
+
+    # Maximum number of messages waiting to be sent, senders wait when the
+    # queue is full so a slow connection slows them down
+    send_queue_size = 64
+
     def __init__(
         self,
         server: str,
@@ -50,19 +88,76 @@ class GaleneBot:
         self.password = password
         self.client_id = client_id
         self.conn = None  # websocket connection
+        self._send_queue = None  # messages waiting to be sent
+        self._writer_task = None
+        self._chat_prefix = None  # encoded static chat fields, see _connect
 
         # Status
         self.joined = False
+        self._now_ms = int(time.time() * 1000)  # refreshed on each message
         self.users = {}  # Map user id to name
 
+        # Map message type to handler, a handler returns True to stop the loop
+        self._handlers = {
+            "ping": self._handle_ping,
+            "usermessage": self._handle_usermessage,
+            "joined": self._handle_joined,
+            "user": self._handle_user,
+            "chat": self._handle_chat,
+        }
+        for message_type in ("abort", "answer", "ice", "renegotiate"):
+            # Ignore as we do not stream media
+            self._handlers[message_type] = self._handle_ignore
+
     async def send(self, message: dict):
         """Send message to remote.
 
+        Message is queued and sent by the writer task, so the caller only
+        waits for the network when the queue is full.
+
         :param message: message to send
         :type message: dict
         """
-        message = json.dumps(message)
-        await self.conn.send(message)
+        await self._send_raw(_dumps(message))
+
+    async def _send_raw(self, data: str):
+        """Queue encoded message for the writer task.
+
+        :param data: JSON encoded message
+        :type data: str
+        :raises ConnectionError: if the writer task stopped
+        """
+        if self._writer_task.done():
+            if not self._writer_task.cancelled():
+                self._writer_task.result()  # raise why the writer failed
+            raise ConnectionError("Connection to Galène is closed")
+        await self._send_queue.put(data)
+
+    async def _writer_loop(self):
+        """Send queued messages to remote, in order."""
+        while True:
+            message = await self._send_queue.get()
+            await self.conn.send(message)
+            self._send_queue.task_done()
+
+    def _on_writer_done(self, task):
+        """Close connection if the writer failed, this stops the client loop.
+
+        :param task: writer task
+        :type task: asyncio.Task
+        """
+        if task.cancelled():
+            return
+        log.error(f"Failed to send message: {task.exception()!r}")
+        asyncio.ensure_future(self.conn.close())
+
+    async def _flush(self):
+        """Wait for queued messages to be sent, unless the writer stops."""
+        join_task = asyncio.ensure_future(self._send_queue.join())
+        await asyncio.wait(
+            {join_task, self._writer_task}, return_when=asyncio.FIRST_COMPLETED
+        )
+        join_task.cancel()
 
     async def send_chat(self, value="", dest="", kind=""):
         """Send chat message.
@@ -74,36 +169,42 @@ class GaleneBot:
         :param kind: Kind of message, can be "me" or "", defaults to ""
         :type kind: str, optional
         """
-        await self.send(
-            {
-                "type": "chat",
-                "kind": kind,
-                "source": self.client_id,
-                "username": self.username,
-                "dest": dest,
-                "noecho": True,
-                "value": value,
-            }
-        )
+        # Append variable fields, without the opening brace
+        suffix = _dumps({"kind": kind, "dest": dest, "value": value})[1:]
+        await self._send_raw(f"{self._chat_prefix},{suffix}")
 
-    @staticmethod
-    def is_history(time: datetime, time_frame=5):
+    def is_history(self, time_ms: int, time_frame_ms=5000):
         """Check if time is in the past.
 
-        :param time: time of the event
-        :type time: datetime
-        :param time_frame: time frame in seconds, defaults to 5
-        :type time_frame: int, optional
+        :param time_ms: time of the event, in milliseconds since epoch
+        :type time_ms: int
+        :param time_frame_ms: time frame in milliseconds, defaults to 5000
+        :type time_frame_ms: int, optional
         :return if time is before now (with margin of time frame)
         """
-        return time + timedelta(seconds=time_frame) < datetime.now()
+        return time_ms + time_frame_ms < self._now_ms
 
     async def _connect(self):
         """Connect to server."""
         # Create WebSocket
         log.info(f"Connecting to {self.server}")
-        ssl_ctx = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
-        self.conn = await websockets.connect(self.server, ssl=ssl_ctx)
+        self.conn = await websockets.connect(
+            self.server, ssl=_get_ssl_context(), compression=self.ws_compression
+        )
+        self._send_queue = asyncio.Queue(maxsize=self.send_queue_size)
+        self._writer_task = asyncio.ensure_future(self._writer_loop())
+        self._writer_task.add_done_callback(self._on_writer_done)
+
+        # Encode fields that are common to all sent chat messages only once
+        # per connection, without the closing brace
+        self._chat_prefix = _dumps(
+            {
+                "type": "chat",
+                "source": self.client_id,
+                "username": self.username,
+                "noecho": True,
+            }
+        )[:-1]
 
         # Handshake with server
         log.debug("Handshaking")
@@ -126,56 +227,80 @@ class GaleneBot:
         await self.send(msg)
 
     async def loop(self):
-        """Client loop."""
-        await self._connect()
-
-        async for message in self.conn:
-            message = json.loads(message)
-            if message["type"] == "ping":
-                # Need to answer pong to ping request to keep connection
-                await self.send({"type": "pong"})
-            elif message["type"] == ["abort", "answer", "ice", "renegotiate"]:
-                # Ignore as we do not stream media
-                continue
-            elif message["type"] == "usermessage":
-                # Server is sending us a message
-                value = message.get("value")
-                if message["kind"] == "error":
-                    log.error(f"Server returned error: {value}")
-                    break
-                else:
-                    log.warn(f"Not implemented {message}")
-            elif message["type"] == "joined":
-                # Response to the group join request
-                if message.get("kind") != "join":
-                    log.error("Failed to join room")
+        """Client loop.
+
+        :raises Exception: if a message could not be sent
+        """
+        try:
+            await self._connect()
+
+            async for message in self.conn:
+                self._now_ms = int(time.time() * 1000)
+                message = _loads(message)
+                handler = self._handlers.get(message["type"], self._handle_unknown)
+                if await handler(message):
                     break
-                self.joined = True
-            elif message["type"] == "user":
-                # User joined or left
-                user_id = message.get("id")
-                username = message.get("username", "(anon)")
-                if message["kind"] == "add":
-                    self.users[user_id] = username
-                    await self.on_user_add(user_id, username)
-                elif message["kind"] == "delete":
-                    del self.users[user_id]
-                    await self.on_user_delete(user_id, username)
-                else:
-                    log.warn(f"Not implemented {message}")
-            elif message["type"] == "chat":
-                # New chat message
-                kind = message.get("kind")
-                source = message.get("source")
-                username = message.get("username", "(anon)")
-                value = message.get("value", "")
-                time = message.get("time", 0)
-                if time > 0:
-                    time = datetime.fromtimestamp(time / 1000)
-                await self.on_chat(kind, source, username, value, time)
-            else:
-                # Oh no! We receive something not implemented
-                log.warn(f"Not implemented {message}")
+
+            # Send messages queued before stopping, such as a last reply
+            await self._flush()
+        finally:
+            if self._writer_task is not None:
+                self._writer_task.cancel()
+                await asyncio.wait({self._writer_task})
+
+        # Report writer failure to the caller, as send() did before queueing
+        if self._writer_task.done() and not self._writer_task.cancelled():
+            raise self._writer_task.exception()
+
+    async def _handle_ping(self, message: dict):
+        """Answer pong to ping request to keep connection."""
+        await self.send({"type": "pong"})
+
+    async def _handle_ignore(self, message: dict):
+        """Ignore message."""
+        pass
+
+    async def _handle_unknown(self, message: dict):
+        """Oh no! We receive something not implemented."""
+        log.warn(f"Not implemented {message}")
+
+    async def _handle_usermessage(self, message: dict):
+        """Server is sending us a message."""
+        value = message.get("value")
+        if message["kind"] == "error":
+            log.error(f"Server returned error: {value}")
+            return True
+        log.warn(f"Not implemented {message}")
+
+    async def _handle_joined(self, message: dict):
+        """Response to the group join request."""
+        if message.get("kind") != "join":
+            log.error("Failed to join room")
+            return True
+        self.joined = True
+
+    async def _handle_user(self, message: dict):
+        """User joined or left."""
+        user_id = sys.intern(message.get("id", ""))
+        username = message.get("username", "(anon)")
+        if message["kind"] == "add":
+            self.users[user_id] = username
+            await self.on_user_add(user_id, username)
+        elif message["kind"] == "delete":
+            # Prefer the name we stored when the user joined
+            username = self.users.pop(user_id, username)
+            await self.on_user_delete(user_id, username)
+        else:
+            log.warn(f"Not implemented {message}")
+
+    async def _handle_chat(self, message: dict):
+        """New chat message."""
+        kind = message.get("kind")
+        source = message.get("source")
+        username = message.get("username", "(anon)")
+        value = message.get("value", "")
+        time_ms = message.get("time", 0)
+        await self.on_chat(kind, source, username, value, time_ms)
 
     async def on_user_add(self, user_id: str, username: str):
         """User joined group event.
@@ -210,7 +335,7 @@ class GaleneBot:
         :type username: str
         :param value: text message
         :type value: str
-        :param time: time of the message
+        :param time: time of the message, in milliseconds since epoch
         :type time: int
         """
         pass